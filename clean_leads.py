@@ -1,19 +1,176 @@
 import pandas as pd
 import streamlit as st
 from io import BytesIO
-from rapidfuzz import process, fuzz
-import unicodedata
-import re
-
-# --- Normalization function with extra cleaning ---
-def normalize_extra(text):
-    if not isinstance(text, str):
-        return ""
-    text = unicodedata.normalize("NFKD", text)
-    text = text.encode("ascii", "ignore").decode("utf-8")
-    text = re.sub(r"[^\w\s]", "", text)
-    text = re.sub(r"\s+", " ", text)
-    return text.strip().lower()
+from rapidfuzz import fuzz
+from rapidfuzz.process import cdist
+import numpy as np
+import importlib.util
+import hashlib
+
+# --- Normalization with extra cleaning (vectorized over a whole column) ---
+# Kept as pattern strings rather than re.compile() objects: pandas hands plain
+# patterns to pyarrow's regex kernels on arrow-backed columns, while compiled
+# patterns force a per-row Python fallback.
+_PUNCT = r"[^\w\s]"
+_WS = r"\s+"
+# ASCII whitespace that Python's \s matches but pyarrow's (RE2) does not
+_CTRL_WS = r"[\x0b\x1c-\x1f]"
+_NON_ASCII = r"[^\x00-\x7f]+"
+
+def _fold_to_ascii(s):
+    # Most company names are plain ASCII already; only decompose and drop accents
+    # on the rest. Stripping non-ASCII with a regex equals encode("ascii", "ignore")
+    # and, unlike .str.decode, also works on arrow-backed columns.
+    non_ascii = s.str.contains(_NON_ASCII, regex=True).eq(True)
+    if not non_ascii.any():
+        return s
+    folded = s[non_ascii].str.normalize("NFKD").str.replace(_NON_ASCII, "", regex=True)
+    return s.mask(non_ascii, folded)
+
+def _text_only(s):
+    # Only text cells are company names; numbers, dates and blanks become ""
+    if isinstance(s.dtype, pd.StringDtype):
+        return s.fillna("")
+    return s.astype(object).where(s.map(lambda v: isinstance(v, str)), "")
+
+def normalize_series(s):
+    # Company names repeat a lot across lead rows, so clean each distinct value once
+    uniq = s.drop_duplicates()
+    cleaned = (
+        _fold_to_ascii(_text_only(uniq))
+        .str.replace(_CTRL_WS, " ", regex=True)
+        .str.replace(_PUNCT, "", regex=True)
+        .str.replace(_WS, " ", regex=True)
+        .str.strip()
+        .str.lower()
+    )
+    # Blank cells get "" from _text_only like any other non-text cell;
+    # fillna is only a safety net for values the dict lookup might not match
+    return s.map(dict(zip(uniq, cleaned))).fillna("")
+
+# --- Fuzzy matching ---
+SIMILARITY_CUTOFF = 75
+MAX_MATCHES_PER_LEAD = 3
+
+def _length_window(length):
+    # Indel similarity is at most 2*min(|a|,|b|) / (|a|+|b|), so clients outside
+    # [lo, hi] characters can never reach the cutoff against a lead of this length
+    lo = -(-SIMILARITY_CUTOFF * length // (200 - SIMILARITY_CUTOFF))
+    hi = length * (200 - SIMILARITY_CUTOFF) // SIMILARITY_CUTOFF
+    return lo, hi
+
+def _score_length_blocked(queries, choices):
+    # Sort clients by length so every lead length maps to one contiguous slice
+    choice_lengths = np.fromiter(map(len, choices), dtype=np.int64, count=len(choices))
+    by_length = np.argsort(choice_lengths, kind="stable")
+    choices, choice_lengths = choices[by_length], choice_lengths[by_length]
+    query_lengths = np.fromiter(map(len, queries), dtype=np.int64, count=len(queries))
+
+    qi_parts, ci_parts, score_parts = [], [], []
+    for length in np.unique(query_lengths):
+        q_idx = np.flatnonzero(query_lengths == length)
+        lo, hi = _length_window(length)
+        start = np.searchsorted(choice_lengths, lo, side="left")
+        stop = np.searchsorted(choice_lengths, hi, side="right")
+        if start == stop:
+            continue
+        # One batched call scores this group of leads against its client slice
+        # Scores are whole numbers 0-100, 1/4 the size of the default float32 matrix
+        scores = cdist(queries[q_idx], choices[start:stop], scorer=fuzz.ratio,
+                       score_cutoff=SIMILARITY_CUTOFF, dtype=np.uint8, workers=-1)
+        qi, ci = np.nonzero(scores >= SIMILARITY_CUTOFF)
+        # Hits are stored as int32 indices next to uint8 scores
+        qi_parts.append(q_idx[qi].astype(np.int32))
+        ci_parts.append(by_length[start + ci].astype(np.int32))
+        score_parts.append(scores[qi, ci])
+
+    qi = np.concatenate(qi_parts + [np.empty(0, dtype=np.int32)])
+    ci = np.concatenate(ci_parts + [np.empty(0, dtype=np.int32)])
+    scores = np.concatenate(score_parts + [np.empty(0, dtype=np.uint8)])
+    return qi, ci, scores
+
+def _sort_tokens(names):
+    return np.array([" ".join(sorted(name.split())) for name in names], dtype=object)
+
+def find_fuzzy_matches(queries, choices):
+    queries = np.asarray(queries, dtype=object)
+    choices = np.asarray(choices, dtype=object)
+
+    # token_sort_ratio re-sorts both names for every pair it scores. Sorting each
+    # name once and using the plain Indel ratio gives the same scores.
+    sorted_queries, sorted_choices = _sort_tokens(queries), _sort_tokens(choices)
+
+    qi, ci, hit_scores = _score_length_blocked(sorted_queries, sorted_choices)
+
+    # Lead order first, best score first within each lead
+    order = np.lexsort((-hit_scores.astype(np.int16), qi))
+    qi, ci, hit_scores = qi[order], ci[order], hit_scores[order]
+
+    # Same as process.extract(..., limit=3): top 3 per lead, then drop perfect scores.
+    # Leads are never equal to a client name here: exact matches were removed first.
+    rank = np.arange(len(qi)) - np.searchsorted(qi, qi)
+    keep = (rank < MAX_MATCHES_PER_LEAD) & (hit_scores < 100)
+    qi, ci, hit_scores = qi[keep], ci[keep], hit_scores[keep]
+
+    return pd.DataFrame({
+        "Lead Name": queries[qi],
+        "Client Name": choices[ci],
+        "Similarity": hit_scores,
+    })
+
+# --- Cached loading and export (Streamlit reruns the whole script on every interaction) ---
+# Caches are shared by every session on the server, so keep only the most recent entries
+CACHE_MAX_ENTRIES = 16
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def load_and_normalize(file_bytes, col):
+    df = pd.read_excel(BytesIO(file_bytes), engine="calamine")
+    # Arrow strings keep the column in one UTF-8 buffer, so the exact-match
+    # lookup and fuzzy prep run over it in C. The user's own column is left as read.
+    df["normalized_name"] = normalize_series(df[col]).astype("string[pyarrow]")
+    return df
+
+# xlsxwriter only writes (no workbook object model to build), so it is faster
+# and lighter than openpyxl; openpyxl stays as the fallback
+EXCEL_ENGINE = "xlsxwriter" if importlib.util.find_spec("xlsxwriter") else "openpyxl"
+
+def _df_key(df):
+    # Hash the row hashes in order; a plain sum would ignore row order
+    row_hashes = pd.util.hash_pandas_object(df).values
+    return (tuple(df.columns), df.shape, hashlib.sha1(row_hashes.tobytes()).hexdigest())
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def _excel_bytes(_df, df_key):
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine=EXCEL_ENGINE) as writer:
+        _df.to_excel(writer, index=False)
+    return output.getvalue()
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def _csv_bytes(_df, df_key):
+    output = BytesIO()
+    # BOM so Excel opens accented company names correctly
+    _df.to_csv(output, index=False, encoding="utf-8-sig")
+    return output.getvalue()
+
+# Function to convert DataFrame to Excel buffer for download
+def to_excel_buffer(df):
+    return _excel_bytes(df, _df_key(df))
+
+# Function to convert DataFrame to CSV buffer for download (much cheaper than .xlsx)
+def to_csv_buffer(df):
+    return _csv_bytes(df, _df_key(df))
+
+# CSV download, plus the .xlsx version when the user asked for it
+def download_buttons(label, df, file_stem, as_excel):
+    st.download_button(f"📥 {label} ({len(df)} rows)",
+                       data=to_csv_buffer(df),
+                       file_name=f"{file_stem}.csv",
+                       mime="text/csv")
+    if as_excel:
+        st.download_button(f"📥 {label} as Excel ({len(df)} rows)",
+                           data=to_excel_buffer(df),
+                           file_name=f"{file_stem}.xlsx")
 
 # --- Streamlit App ---
 st.set_page_config(page_title="Lead Cleaner", layout="centered")
@@ -26,90 +183,49 @@ clients_file = st.file_uploader("Upload client_list.xlsx", type=["xlsx"], key="c
 
 if leads_file and clients_file:
     with st.spinner("Processing files..."):
-        # Load files
-        leads_df = pd.read_excel(leads_file)
-        clients_df = pd.read_excel(clients_file)
-
         # Columns that need to be used for matching
         leads_column = "companyName"  
         clients_column = "companyName"  
 
-        # Normalize company names in both DataFrames
-        leads_df["normalized_name"] = leads_df[leads_column].apply(normalize_extra)
-        clients_df["normalized_name"] = clients_df[clients_column].apply(normalize_extra)
+        # Load files and normalize company names in both DataFrames
+        leads_df = load_and_normalize(leads_file.getvalue(), leads_column)
+        clients_df = load_and_normalize(clients_file.getvalue(), clients_column)
 
         # Exact match removal
-        exact_normalized_set = set(clients_df["normalized_name"])
-        leads_df["is_exact_match"] = leads_df["normalized_name"].isin(exact_normalized_set)
+        # A hashtable over the distinct client names, probed once per lead in C
+        uniq_clients = clients_df["normalized_name"].unique()
+        exact_normalized_index = pd.Index(uniq_clients)
+        leads_df["is_exact_match"] = exact_normalized_index.get_indexer(leads_df["normalized_name"]) >= 0
         exact_matches_df = leads_df[leads_df["is_exact_match"]].copy()
         filtered_leads = leads_df[~leads_df["is_exact_match"]].copy()
 
         # Fuzzy matching for non-exact matches
-        matches = []
-        client_names_set = set(clients_df["normalized_name"].unique())
         filtered_unique_names = filtered_leads["normalized_name"].drop_duplicates()
+        # Names that normalize to "" (blank or punctuation only) can't meaningfully match
+        filtered_unique_names = filtered_unique_names[filtered_unique_names.str.len() > 0]
+
+        fuzzy_df = find_fuzzy_matches(filtered_unique_names.tolist(), uniq_clients)
 
-        for lead_name in filtered_unique_names:
-            if lead_name in exact_normalized_set:
-                continue
-            similars = process.extract(
-                lead_name,
-                client_names_set,
-                scorer=fuzz.token_sort_ratio,
-                limit=3
-            )
-            for match_name, score, _ in similars:
-                if 75 <= score < 100 and lead_name != match_name:
-                    matches.append({
-                        "Lead Name": lead_name,
-                        "Client Name": match_name,
-                        "Similarity": score
-                    })
-
-        fuzzy_df = pd.DataFrame(matches)
-
-        # Merge fuzzy matches with original names
-        if "Lead Name" in fuzzy_df.columns and not fuzzy_df.empty:
-            fuzzy_df = fuzzy_df.merge(
-                leads_df[[leads_column, "normalized_name"]],
-                left_on="Lead Name",
-                right_on="normalized_name",
-                how="left"
-            ).rename(columns={leads_column: "Original name in leads_sn.xlsx"}).drop(columns=["normalized_name"])
+        # Attach the original (first-seen) spelling of each matched lead
+        orig_by_norm = (filtered_leads.drop_duplicates("normalized_name")
+                        .set_index("normalized_name")[leads_column].to_dict())
+        fuzzy_df["Original name in leads_sn.xlsx"] = fuzzy_df["Lead Name"].map(orig_by_norm)
 
         # **Aquí está el fix: ahora NO eliminamos fuzzy matches del archivo final**
         final_leads = filtered_leads.drop(columns=["normalized_name", "is_exact_match"])
 
-        # Row counts
-        exact_matches_count = len(exact_matches_df)
-        fuzzy_matches_count = len(fuzzy_df)
-        final_leads_count = len(final_leads)
-
-        # Function to convert DataFrame to Excel buffer for download
-        def to_excel_buffer(df):
-            output = BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                df.to_excel(writer, index=False)
-            return output.getvalue()
-
         st.success("✅ Done! Download your results below:")
+        as_excel = st.checkbox("Also offer Excel (.xlsx) downloads (slower for big files)")
         
         # Download buttons with descriptions
         st.write("#### ✅ Cleaned Leads")
         st.write("This file contains the final list of leads after removing all client companies from the original file:")
-        st.download_button(f"📥 Download Cleaned Leads ({final_leads_count} rows)", 
-                           data=to_excel_buffer(final_leads), 
-                           file_name="cleaned_leads.xlsx")
+        download_buttons("Download Cleaned Leads", final_leads, "cleaned_leads", as_excel)
 
         st.write("#### 🔍 Similar Matches to Review")
         st.write("This file contains company names that are similar but not exact matches to the exclusion list. You might want to review these manually:")
-        st.download_button(f"📥 Download Similar Matches to Review ({fuzzy_matches_count} rows)", 
-                           data=to_excel_buffer(fuzzy_df), 
-                           file_name="potential_matches_to_review.xlsx")
+        download_buttons("Download Similar Matches to Review", fuzzy_df, "potential_matches_to_review", as_excel)
 
         st.write("#### ❌ Exact Matches Removed")
         st.write("This file lists all the company names that were an exact match with the exclusion list and were removed from the leads. This is only info, YOU DON'T NEED TO DOWNLOAD 😄.")
-        st.download_button(f"📥 Download Exact Matches Removed ({exact_matches_count} rows)", 
-                           data=to_excel_buffer(exact_matches_df), 
-                           file_name="exact_matches_removed.xlsx")
-
+        download_buttons("Download Exact Matches Removed", exact_matches_df, "exact_matches_removed", as_excel)